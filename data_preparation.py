@@ -1,5 +1,5 @@
 import pandas as pd
-import json
+import orjson
 import os
 from pathlib import Path
 
@@ -45,8 +45,8 @@ def prepare_data():
     
     # Save as JSON
     output_path = data_dir / "sample_data.json"
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(sample_data, f, indent=2)
+    with open(output_path, 'wb') as f:
+        f.write(orjson.dumps(sample_data, option=orjson.OPT_INDENT_2))
     
     print(f"Sample data saved to {output_path}")
     return str(output_path)
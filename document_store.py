@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+DOCUMENT_STORE_PATH = os.getenv("DOCUMENT_STORE_PATH", str(Path("data") / "documents.sqlite"))
+# Ids per SELECT, kept below SQLite's 999-variable limit on builds older than 3.32
+_MAX_IDS_PER_QUERY = 500
+
+class DocumentStore:
+    """Local sqlite store for document text and metadata, keyed by (index_name, id).
+    Pinecone only keeps each vector's source; search rehydrates the rest from here.
+    """
+    def __init__(self, path=DOCUMENT_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "index_name TEXT, id TEXT, text TEXT, source TEXT, metadata TEXT, "
+            "PRIMARY KEY (index_name, id))"
+        )
+        self._conn.commit()
+    
+    def put_many(self, index_name, rows):
+        """Insert or replace an iterable of (id, text, source, metadata_json) rows for an index."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (index_name, id, text, source, metadata) VALUES (?, ?, ?, ?, ?)",
+                [(index_name, *row) for row in rows]
+            )
+            self._conn.commit()
+    
+    def get_many(self, index_name, ids):
+        """Return {id: {"text", "source", "metadata"}} for the ids found in an index."""
+        ids = list(ids)
+        rows = []
+        with self._lock:
+            for start in range(0, len(ids), _MAX_IDS_PER_QUERY):
+                chunk = ids[start:start + _MAX_IDS_PER_QUERY]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._conn.execute(
+                    f"SELECT id, text, source, metadata FROM documents WHERE index_name = ? AND id IN ({placeholders})",
+                    [index_name, *chunk]
+                ).fetchall())
+        return {
+            doc_id: {"text": text, "source": source, "metadata": metadata}
+            for doc_id, text, source, metadata in rows
+        }
+
+_document_store = None
+
+def get_document_store():
+    """Return the process-wide DocumentStore, creating it on first use."""
+    global _document_store
+    if _document_store is None:
+        _document_store = DocumentStore()
+    return _document_store
@@ -1,132 +1,263 @@
 import os
+import copy
 import json
+import threading
+from collections import deque
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
 import google.generativeai as genai
-from vector_db import VectorDB
+from vector_db import VectorDB, cosine_similarities, quantize_i8
 
 # Load environment variables
 load_dotenv()
 
+# Only {context} and {query} vary per call
+PROMPT_TMPL = (
+    "You are a helpful AI assistant. Use the following context to answer the question at the end.\n"
+    "If the context doesn't contain the answer, just say that you don't know, don't try to make up an answer.\n"
+    "\n"
+    "Context:\n"
+    "{context}\n"
+    "\n"
+    "Question: {query}\n"
+    "\n"
+    "Answer the question based on the context above. If the answer isn't in the context, "
+    "say \"I don't have enough information to answer that question.\"\n"
+    "Answer:"
+)
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails; the message is safe to show to the user."""
+
 class RAGPipeline:
-    def __init__(self, vector_db):
-        """Initialize the RAG pipeline with a vector database instance."""
+    def __init__(self, vector_db, semantic_cache_threshold=0.95, semantic_cache_size=256):
+        """Initialize the RAG pipeline with a vector database instance.
+        Responses to queries whose embeddings have cosine similarity above
+        `semantic_cache_threshold` with a recent query (at the same top_k) are served
+        from an in-memory cache, which is cleared whenever the vector database changes.
+        """
         self.vector_db = vector_db
+        self.semantic_cache_threshold = semantic_cache_threshold
+        self._sem_cache = deque(maxlen=semantic_cache_size)
+        self._sem_mat = None
+        self._sem_top_k = None
+        self._sem_version = vector_db.data_version
+        self._sem_lock = threading.Lock()  # generate_response may run on several threads
         
-        # Initialize Gemini with model selection and fallback
+        # Initialize Gemini with the preferred model. Model construction is local, so
+        # availability is only checked (via list_models) if a call fails with a 404;
+        # see call_gemini_generate.
         try:
             genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
             
             preferred_model_name = 'gemini-1.5-flash' # Set modern preference
-            
-            print("\nChecking for available Gemini models...")
-            available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-            print(f"Found models: {available_models}")
-
-            if f'models/{preferred_model_name}' in available_models:
-                print(f"Preferred model '{preferred_model_name}' is available. Initializing...")
-                self.model = genai.GenerativeModel(preferred_model_name)
-            else:
-                print(f"Warning: Preferred model '{preferred_model_name}' not found.")
-                # Find the first suitable fallback model
-                if available_models:
-                    fallback_model_name = available_models[0].replace('models/', '')
-                    print(f"Using first available model as fallback: '{fallback_model_name}'")
-                    self.model = genai.GenerativeModel(fallback_model_name)
-                else:
-                    raise ValueError("No suitable Gemini models found for content generation.")
+            print(f"\nInitializing Gemini model '{preferred_model_name}'...")
+            self.model = genai.GenerativeModel(preferred_model_name)
 
         except Exception as e:
             print(f"An error occurred during Gemini API initialization: {e}")
             print("Please ensure your GEMINI_API_KEY is correct and you have access to the models.")
             raise
     
-    def call_gemini_generate(self, prompt: str) -> str:
-        """Call Gemini generate with graceful fallback if the active model is unavailable.
-        - If a 404/not found occurs, list models and switch to a valid one, then retry once.
-        - Returns the response text or a friendly error message.
+    def _switch_to_fallback_model(self):
+        """Re-list models and switch to the first one supporting generateContent.
+        Returns False if no such model is available.
         """
+        models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+        if not models:
+            print("No Gemini models available for generateContent.")
+            return False
+        fallback_model_name = models[0].replace('models/', '')
+        print(f"Active model unavailable. Switching to fallback model: {fallback_model_name}")
+        self.model = genai.GenerativeModel(fallback_model_name)
+        return True
+    
+    def _generate_content(self, prompt, stream=False):
+        """Call generate_content, retrying once on a fallback model after a 404; raises GeminiError."""
         try:
-            resp = self.model.generate_content(prompt)
-            return getattr(resp, 'text', '').strip()
+            return self.model.generate_content(prompt, stream=stream)
         except Exception as e:
             msg = str(e).lower()
             if '404' in msg or 'not found' in msg or 'unsupported' in msg:
                 # Re-list models and pick a fallback
                 try:
-                    models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-                    if not models:
-                        print("No Gemini models available for generateContent.")
-                        return "I'm sorry, no compatible Gemini models are available right now."
-                    fallback_model_name = models[0].replace('models/', '')
-                    print(f"Active model unavailable. Switching to fallback model: {fallback_model_name}")
-                    self.model = genai.GenerativeModel(fallback_model_name)
-                    # Retry once
-                    resp = self.model.generate_content(prompt)
-                    return getattr(resp, 'text', '').strip()
+                    switched = self._switch_to_fallback_model()
+                    if switched:
+                        # Retry once
+                        return self.model.generate_content(prompt, stream=stream)
                 except Exception as inner_e:
                     print(f"Failed to switch to a fallback model: {inner_e}")
-                    return "I'm sorry, the language model is currently unavailable. Please try again later."
-            else:
-                print(f"Error generating response: {e}")
-                return "I'm sorry, I encountered an error while generating a response."
+                    raise GeminiError("I'm sorry, the language model is currently unavailable. Please try again later.") from inner_e
+                raise GeminiError("I'm sorry, no compatible Gemini models are available right now.")
+            print(f"Error generating response: {e}")
+            raise GeminiError("I'm sorry, I encountered an error while generating a response.") from e
+    
+    def _generate_text(self, prompt):
+        """Return the full response text for a prompt, raising GeminiError on failure."""
+        resp = self._generate_content(prompt)
+        try:
+            return getattr(resp, 'text', '').strip()
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            raise GeminiError("I'm sorry, I encountered an error while generating a response.") from e
+    
+    @staticmethod
+    def _stream_text(resp):
+        """Yield the text of each chunk of a streamed Gemini response, raising GeminiError on failure."""
+        try:
+            for chunk in resp:
+                text = getattr(chunk, 'text', '')
+                if text:
+                    yield text
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            raise GeminiError("I'm sorry, I encountered an error while generating a response.") from e
+    
+    def call_gemini_generate(self, prompt: str) -> str:
+        """Call Gemini generate with graceful fallback if the active model is unavailable.
+        Returns the response text or a friendly error message.
+        """
+        try:
+            return self._generate_text(prompt)
+        except GeminiError as e:
+            return str(e)
+    
+    def call_gemini_stream(self, prompt: str) -> Iterator[str]:
+        """Stream a Gemini response as text chunks, with the same fallback as call_gemini_generate.
+        The request is sent immediately; chunks are yielded as they arrive when the
+        returned iterator is consumed. Failures are yielded as a friendly error message.
+        """
+        try:
+            resp = self._generate_content(prompt, stream=True)
+        except GeminiError as e:
+            return iter([str(e)])
+        
+        def chunks():
+            try:
+                yield from self._stream_text(resp)
+            except GeminiError as e:
+                yield str(e)
+        return chunks()
     
     def _format_context(self, search_results):
         """Format search results into a context string."""
-        context = ""
+        parts = []
         for i, match in enumerate(search_results.matches):
-            # Correctly access the metadata attribute of the Match object
-            metadata = match.metadata
-            context += f"Context {i+1} (Source: {metadata.get('source', 'Unknown')}):\n"
-            context += f"{metadata.get('text', '')}\n\n"
-        return context.strip()
+            parts.append(f"Context {i+1} (Source: {match.source}):\n{match.text}")
+        return "\n\n".join(parts).strip()
     
-    def generate_response(self, query, top_k=3):
-        """Generate a response using RAG."""
+    def _semantic_cache_lookup(self, query_vec, top_k):
+        """Return a copy of the cached response for a near-duplicate query at this top_k, or None."""
+        with self._sem_lock:
+            if self._sem_version != self.vector_db.data_version:
+                # Documents were upserted since these answers were cached
+                self._sem_cache.clear()
+                self._sem_mat = None
+                self._sem_version = self.vector_db.data_version
+            if not self._sem_cache:
+                return None
+            if self._sem_mat is None:
+                # Rebuild the stacked matrix lazily after the cache has changed
+                # Entries are stored int8-quantized to cut memory bandwidth for the brute-force scan
+                self._sem_mat = np.ascontiguousarray(np.stack([vec for vec, _, _ in self._sem_cache]))
+                self._sem_top_k = np.array([k for _, k, _ in self._sem_cache])
+            sims = cosine_similarities(self._sem_mat, quantize_i8(query_vec)[0])
+            sims = np.where(self._sem_top_k == top_k, sims, -np.inf)
+            best = int(np.argmax(sims))
+            if sims[best] > self.semantic_cache_threshold:
+                return copy.deepcopy(self._sem_cache[best][2])
+            return None
+    
+    def _semantic_cache_store(self, query_vec, top_k, version, response):
+        """Remember a copy of a response and invalidate the stacked similarity matrix.
+        Responses computed against an older version of the vector database are dropped.
+        """
+        with self._sem_lock:
+            if version != self.vector_db.data_version or version != self._sem_version:
+                return
+            self._sem_cache.append((quantize_i8(query_vec)[0], top_k, copy.deepcopy(response)))
+            self._sem_mat = None
+    
+    @staticmethod
+    def _as_stream(response):
+        """Wrap a complete response so its answer is a single-chunk iterator."""
+        return {**response, "answer": iter([response["answer"]])}
+    
+    def generate_response(self, query, top_k=3, stream=False):
+        """Generate a response using RAG.
+        With stream=True the returned "answer" is an iterator of text chunks instead of a string.
+        """
         try:
+            # Serve near-duplicate queries from the semantic cache
+            query_vec = self.vector_db.embed_query(query)
+            cached = self._semantic_cache_lookup(query_vec, top_k)
+            if cached is not None:
+                return self._as_stream(cached) if stream else cached
+            version = self.vector_db.data_version
+            
             # Retrieve relevant context
             search_results = self.vector_db.search(query, top_k=top_k)
             context = self._format_context(search_results)
             
             if not context:
-                return {
+                response = {
                     "answer": "I couldn't find any relevant information to answer your question.",
                     "sources": []
                 }
+                return self._as_stream(response) if stream else response
             
             # Create the prompt with context
-            prompt = f"""You are a helpful AI assistant. Use the following context to answer the question at the end. 
-            If the context doesn't contain the answer, just say that you don't know, don't try to make up an answer.
-            
-            Context:
-            {context}
+            prompt = PROMPT_TMPL.format(context=context, query=query)
             
-            Question: {query}
+            sources = [
+                {"text": match.text, "source": match.source, "score": match.score}
+                for match in search_results.matches
+            ]
             
-            Answer the question based on the context above. If the answer isn't in the context, say "I don't have enough information to answer that question."
-            Answer:"""
+            # Failed Gemini calls return their error message but are never cached
+            if stream:
+                try:
+                    resp = self._generate_content(prompt, stream=True)
+                except GeminiError as e:
+                    return self._as_stream({"answer": str(e), "sources": sources})
+                
+                def answer_stream():
+                    parts = []
+                    try:
+                        for chunk in self._stream_text(resp):
+                            parts.append(chunk)
+                            yield chunk
+                    except GeminiError as e:
+                        yield str(e)
+                        return
+                    # Cache the full answer once the stream has been consumed
+                    response = {"answer": "".join(parts).strip(), "sources": sources}
+                    self._semantic_cache_store(query_vec, top_k, version, response)
+                
+                return {"answer": answer_stream(), "sources": sources}
             
             # Generate response using Gemini with graceful fallback
-            answer = self.call_gemini_generate(prompt)
+            try:
+                answer = self._generate_text(prompt)
+            except GeminiError as e:
+                return {"answer": str(e), "sources": sources}
             
-            return {
+            response = {
                 "answer": answer,
-                "sources": [
-                    {
-                        "text": match.metadata.get("text", ""),
-                        "source": match.metadata.get("source", "Unknown"),
-                        "score": getattr(match, 'score', 0.0)
-                    }
-                    for match in getattr(search_results, 'matches', [])
-                    if hasattr(match, 'metadata')
-                ]
+                "sources": sources
             }
+            self._semantic_cache_store(query_vec, top_k, version, response)
+            return response
             
         except Exception as e:
             print(f"Error in generate_response: {e}")
-            return {
+            response = {
                 "answer": "I encountered an error while processing your request. Please try again.",
                 "sources": []
             }
+            return self._as_stream(response) if stream else response
 
 def test_rag_pipeline():
     """Test the RAG pipeline with a sample query."""
@@ -155,13 +286,20 @@ def test_rag_pipeline():
             "What was the Renaissance?"
         ]
         
-        for query in queries:
+        # Retrieval and the wait for each stream's first token run in parallel;
+        # the streamed answers are then read one query after another below
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            responses = list(executor.map(lambda q: rag.generate_response(q, stream=True), queries))
+        
+        for query, response in zip(queries, responses):
             print(f"\n{'='*80}")
             print(f"Query: {query}")
             
-            # Get and display response
-            response = rag.generate_response(query)
-            print("\nAnswer:", response["answer"])
+            # Display the answer as it streams in
+            print("\nAnswer: ", end="", flush=True)
+            for chunk in response["answer"]:
+                print(chunk, end="", flush=True)
+            print()
             
             if response["sources"]:
                 print("\nSources:")
@@ -1,24 +1,296 @@
 import os
 import json
+import orjson
+import sqlite3
+import hashlib
+import threading
+import time
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import torch
 from pathlib import Path
+from dataclasses import dataclass
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
+from document_store import get_document_store
 import pinecone
 
+try:
+    import faiss
+except ImportError:  # optional, only needed for backend="faiss"
+    faiss = None
+
+try:
+    import simsimd
+except ImportError:  # optional SIMD kernels for brute-force cosine similarity
+    simsimd = None
+
 # Load environment variables
 load_dotenv()
 
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", str(Path("data") / "embedding_cache.sqlite"))
+
+def quantize_i8(v):
+    """Symmetrically quantize a float vector to int8, returning (int8 array, scale)."""
+    v = np.asarray(v, dtype=np.float32)
+    scale = float(np.max(np.abs(v))) / 127.0
+    if scale == 0.0:
+        return np.zeros(v.shape, dtype=np.int8), 0.0
+    return np.round(v / scale).astype(np.int8), scale
+
+def dequantize_i8(q, scale):
+    """Inverse of quantize_i8."""
+    return q.astype(np.float32) * np.float32(scale)
+
+class EmbeddingCache:
+    """Persistent embedding cache backed by a sqlite table of int8-quantized vectors.
+    Keys are sha256(model_name + "\\0" + text) so switching models never returns stale vectors.
+    """
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS emb_i8 (hash BLOB PRIMARY KEY, vec BLOB, scale REAL)")
+        # Drop the float32 table left behind by caches created before int8 quantization
+        self._conn.execute("DROP TABLE IF EXISTS emb")
+        self._conn.commit()
+    
+    @staticmethod
+    def key(model_name, text):
+        """Return the cache key for a (model, text) pair."""
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+    
+    def get(self, key):
+        """Return the cached vector for a key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT vec, scale FROM emb_i8 WHERE hash=?", (key,)).fetchone()
+        if row is None:
+            return None
+        return dequantize_i8(np.frombuffer(row[0], dtype=np.int8), row[1])
+    
+    def put_many(self, items):
+        """Store an iterable of (key, vector) pairs."""
+        rows = []
+        for key, vec in items:
+            q, scale = quantize_i8(vec)
+            rows.append((key, q.tobytes(), scale))
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO emb_i8 (hash, vec, scale) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+_embedding_cache = None
+
+def get_embedding_cache():
+    """Return the process-wide EmbeddingCache, creating it on first use."""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384  # Dimension for all-MiniLM-L6-v2
+_MODEL = None
+_PC = None
+_INDEXES = {}
+# Number of threads issuing Pinecone upsert batches in parallel
+PINECONE_UPSERT_WORKERS = 8
+
+def _get_model():
+    """Return the process-wide SentenceTransformer, loading it on first use.
+    Runs on GPU in fp16 when available; MiniLM loses no measurable accuracy at half precision.
+    """
+    global _MODEL
+    if _MODEL is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        _MODEL = SentenceTransformer(MODEL_NAME, device=device)
+        if device == "cuda":
+            _MODEL = _MODEL.half()
+    return _MODEL
+
+def _get_pinecone():
+    """Return the process-wide Pinecone client, creating it on first use."""
+    global _PC
+    if _PC is None:
+        _PC = pinecone.Pinecone(
+            api_key=os.getenv("PINECONE_API_KEY")
+        )
+    return _PC
+
+def _get_index(name):
+    """Return the process-wide Index for a name, so every VectorDB on it shares one connection pool."""
+    index = _INDEXES.get(name)
+    if index is None:
+        index = _INDEXES[name] = _get_pinecone().Index(name)
+    return index
+
+def _wait_until(cond_fn, timeout=60, initial_delay=1.0, max_delay=16.0):
+    """Poll cond_fn with exponential backoff until it returns True or timeout seconds pass.
+    Returns whether the condition was met.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        if cond_fn():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+def cosine_similarities(matrix, vec):
+    """Cosine similarity of each row of `matrix` against `vec`.
+    Accepts float32 or int8 (see quantize_i8) inputs; cosine is scale-invariant, so
+    int8 vectors need no rescaling. Uses SimSIMD's AVX2/AVX-512/NEON kernels when
+    available and falls back to NumPy.
+    """
+    dtype = np.int8 if np.asarray(matrix).dtype == np.int8 else np.float32
+    matrix = np.ascontiguousarray(matrix, dtype=dtype)
+    vec = np.ascontiguousarray(vec, dtype=dtype)
+    if simsimd is not None:
+        distances = np.asarray(simsimd.cdist(matrix, vec[None, :], metric="cosine"))
+        return 1.0 - distances.ravel()
+    matrix = matrix.astype(np.float32, copy=False)
+    vec = vec.astype(np.float32, copy=False)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vec)
+    return (matrix @ vec) / np.maximum(norms, 1e-12)
+
+def _embed_texts(texts):
+    """Convert a list of texts to embedding vectors in a single batched encode call.
+    Vectors already in the embedding cache are reused; only misses are encoded.
+    """
+    model = _get_model()
+    cache = get_embedding_cache()
+    keys = [EmbeddingCache.key(MODEL_NAME, text) for text in texts]
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    
+    # Positions of each distinct cache miss, so repeated texts are encoded once
+    missing = {}
+    for i, key in enumerate(keys):
+        if key in missing:
+            missing[key].append(i)
+            continue
+        cached = cache.get(key)
+        if cached is None:
+            missing[key] = [i]
+        else:
+            embeddings[i] = cached
+    
+    if missing:
+        # Repeat texts are answered above (and by the query LRU, and by deduplicating
+        # misses) before tokenization, so tokenize + forward only ever runs once per
+        # distinct text; a separate tokenized-input cache would never get a hit.
+        encoded = model.encode(
+            [texts[positions[0]] for positions in missing.values()],
+            batch_size=128 if model.device.type == "cuda" else 64,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        for positions, vec in zip(missing.values(), encoded):
+            embeddings[positions] = vec
+        cache.put_many((key, embeddings[positions[0]]) for key, positions in missing.items())
+    
+    return embeddings
+
+@lru_cache(maxsize=2048)
+def _encode_cached(text):
+    """Embed a single query string, memoized in-process.
+    Keyed by text alone since every VectorDB shares the MODEL_NAME model, so identical
+    queries hit across VectorDB objects.
+    Memory cost at capacity is about 2048 x 384 x 4 B = 3 MB.
+    """
+    vec = _embed_texts([text])[0]
+    vec.setflags(write=False)  # shared between callers
+    return vec
+
+def _dumps_metadata(metadata):
+    """Serialize document metadata with orjson, falling back to json for values orjson
+    rejects (integers beyond 64 bits) or would change (NaN/Infinity written as null).
+    """
+    try:
+        out = orjson.dumps(metadata, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        return json.dumps(metadata)
+    if b"null" in out:
+        # Possibly a non-finite float; None values also land here, which is harmless
+        return json.dumps(metadata)
+    return out.decode()
+
+def _loads_metadata(data):
+    """Parse metadata written by _dumps_metadata, returning {} if it is not valid JSON."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
+    # json.dumps output (the fallback above, or vectors written before orjson) uses ": "
+    # separators; parse it with json so big integers and NaN/Infinity round-trip exactly
+    if '": ' not in data:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    try:
+        return json.loads(data)
+    except ValueError:
+        return {}
+
+@dataclass
+class Match:
+    """A single search hit with fields validated in VectorDB.search, so callers use plain attribute access."""
+    __slots__ = ("id", "score", "text", "source", "metadata")
+    id: str
+    score: float
+    text: str
+    source: str
+    metadata: dict
+    
+    @classmethod
+    def from_metadata(cls, id, score, metadata):
+        """Build a Match from a stored metadata dict of text, source and JSON-encoded metadata."""
+        doc_metadata = metadata.get('metadata') or {}
+        if isinstance(doc_metadata, (str, bytes)):
+            doc_metadata = _loads_metadata(doc_metadata)
+        return cls(
+            id=str(id),
+            score=float(score),
+            text=metadata.get('text') or '',
+            source=metadata.get('source') or 'unknown',
+            metadata=doc_metadata
+        )
+
+@dataclass
+class SearchResults:
+    __slots__ = ("matches",)
+    matches: list
+
 class VectorDB:
-    def __init__(self, index_name="rag-demo"):
+    def __init__(self, index_name="rag-demo", backend="pinecone"):
+        """Create a vector store.
+        backend="pinecone" uses a remote Pinecone index; backend="faiss" keeps an
+        in-process FAISS IndexFlatIP, which avoids network round-trips for small corpora.
+        """
+        if backend not in ("pinecone", "faiss"):
+            raise ValueError(f"Unknown backend '{backend}', expected 'pinecone' or 'faiss'.")
         self.index_name = index_name
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.embedding_dim = 384  # Dimension for all-MiniLM-L6-v2
+        self.backend = backend
+        self.model = _get_model()
+        self.embedding_dim = EMBEDDING_DIM
+        # Bumped after every upsert so callers caching search-derived results can invalidate them
+        self.data_version = 0
+        
+        if self.backend == "faiss":
+            if faiss is None:
+                raise ImportError("The faiss backend requires the 'faiss-cpu' package.")
+            self._faiss = faiss.IndexFlatIP(self.embedding_dim)
+            self._meta = []
+            self._id_pos = {}
+            print(f"Using local FAISS index for {self.index_name}")
+            return
         
         # Initialize Pinecone client
-        self.pc = pinecone.Pinecone(
-            api_key=os.getenv("PINECONE_API_KEY")
-        )
+        self.pc = _get_pinecone()
         
         # Check if index exists
         if self.index_name not in self.pc.list_indexes().names():
@@ -36,8 +308,7 @@ class VectorDB:
                 )
                 # Wait for index to be ready
                 print("Waiting for index to be ready...")
-                import time
-                time.sleep(30)
+                self._wait_for_index_ready()
             except Exception as e:
                 print(f"Error creating index with ServerlessSpec: {e}")
                 print("Attempting to create index with PodSpec for free tier...")
@@ -48,46 +319,84 @@ class VectorDB:
                     spec=pinecone.PodSpec(environment='gcp-starter')
                 )
                 print("Waiting for index to be ready...")
-                import time
-                time.sleep(30)
+                self._wait_for_index_ready()
         else:
             print(f"Index '{self.index_name}' already exists.")
         
-        self.index = self.pc.Index(self.index_name)
+        # Indexes are shared across VectorDB instances: each one's urllib3 connection
+        # pool keeps connections alive, so only the first request pays the TLS handshake.
+        self.index = _get_index(self.index_name)
         print(f"Connected to index {self.index_name}")
     
+    def _wait_for_index_ready(self, timeout=60):
+        """Poll describe_index until the Pinecone index reports ready."""
+        def is_ready():
+            try:
+                return bool(self.pc.describe_index(self.index_name).status['ready'])
+            except Exception:
+                return False
+        if not _wait_until(is_ready, timeout=timeout):
+            print(f"Warning: index {self.index_name} was not ready after {timeout} seconds.")
+    
+    def embed_texts(self, texts):
+        """Convert a list of texts to embedding vectors in a single batched encode call."""
+        return _embed_texts(texts)
+    
+    def embed_query(self, text):
+        """Return the (read-only) embedding array for a query, served from the in-process LRU cache."""
+        return _encode_cached(text)
+    
     def embed_text(self, text):
-        """Convert text to embedding vector."""
-        return self.model.encode(text).tolist()
+        """Convert text to a read-only float32 embedding array."""
+        return self.embed_query(text)
     
     def upsert_documents(self, documents):
         """Upsert documents to the vector database."""
         vectors = []
         print(f"Preparing to upsert {len(documents)} documents...")
         
+        # First pass: validate documents and collect texts for batched encoding
+        texts = []
+        meta_list = []
         for i, doc in enumerate(documents, 1):
+            if not isinstance(doc, dict):
+                print(f"Document {i} is not a dictionary: {doc}")
+                continue
+                
+            text = doc.get("text", "")
+            if not text:
+                print(f"Document {i} has no text content: {doc}")
+                continue
+            
+            texts.append(text)
+            meta_list.append((i, doc))
+        
+        if not texts:
+            print("No valid documents to upsert.")
+            return
+        
+        # Second pass: encode all texts at once and zip them back to their documents
+        try:
+            embeddings = self.embed_texts(texts)
+        except Exception as e:
+            print(f"Error embedding documents: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return
+        
+        for (i, doc), vec in zip(meta_list, embeddings):
             try:
-                if not isinstance(doc, dict):
-                    print(f"Document {i} is not a dictionary: {doc}")
-                    continue
-                    
-                text = doc.get("text", "")
-                if not text:
-                    print(f"Document {i} has no text content: {doc}")
-                    continue
-                    
-                vector = self.embed_text(text)
                 metadata = {
-                    "text": text,
+                    "text": doc["text"],
                     "source": doc.get("source", "unknown"),
-                    "metadata": json.dumps(doc.get("metadata", {}))
+                    "metadata": _dumps_metadata(doc.get("metadata", {}))
                 }
                 
                 doc_id = str(doc.get("id", f"doc_{i}"))
                 
                 vectors.append({
                     'id': doc_id,
-                    'values': vector,
+                    'values': vec,
                     'metadata': metadata
                 })
                 
@@ -99,35 +408,59 @@ class VectorDB:
                 import traceback
                 traceback.print_exc()
         
-        # Upsert in batches of 20 (smaller batches for better reliability)
-        batch_size = 20
+        if not vectors:
+            print("No documents were prepared for upsert.")
+            return
+        
+        if self.backend == "faiss":
+            self._upsert_faiss(vectors)
+            return
+        
+        # Keep text and metadata locally; Pinecone only needs the source for each vector
+        get_document_store().put_many(
+            self.index_name,
+            [
+                (v['id'], v['metadata']['text'], v['metadata']['source'], v['metadata']['metadata'])
+                for v in vectors
+            ]
+        )
+        # Convert to Python lists once for the whole batch, as the Pinecone SDK requires
+        values = np.stack([v['values'] for v in vectors]).tolist()
+        vectors = [
+            {'id': v['id'], 'values': vals, 'metadata': {'source': v['metadata']['source']}}
+            for v, vals in zip(vectors, values)
+        ]
+        
+        # Upsert in batches of 100 (Pinecone's per-request maximum), issuing batches in parallel
+        batch_size = 100
+        batches = [vectors[i:i + batch_size] for i in range(0, len(vectors), batch_size)]
         total_upserted = 0
         
-        for i in range(0, len(vectors), batch_size):
-            batch = vectors[i:i + batch_size]
-            try:
-                print(f"Upserting batch {i//batch_size + 1}/{(len(vectors)-1)//batch_size + 1}...")
-                response = self.index.upsert(vectors=batch)
-                total_upserted += len(batch)
-                print(f"Successfully upserted {total_upserted}/{len(vectors)} documents")
-            except Exception as e:
-                print(f"Error upserting batch {i//batch_size + 1}: {str(e)}")
+        print(f"Upserting {len(batches)} batch(es) in parallel...")
+        with ThreadPoolExecutor(max_workers=PINECONE_UPSERT_WORKERS) as executor:
+            futures = [executor.submit(self.index.upsert, vectors=batch) for batch in batches]
+            for batch_num, (batch, future) in enumerate(zip(batches, futures), 1):
+                try:
+                    future.result()
+                    total_upserted += len(batch)
+                    print(f"Successfully upserted {total_upserted}/{len(vectors)} documents")
+                except Exception as e:
+                    print(f"Error upserting batch {batch_num}: {str(e)}")
         
         print(f"\nCompleted upserting {total_upserted} documents to index {self.index_name}")
+        self.data_version += 1
         
-        # Wait and verify the index count
-        import time
-        time.sleep(5) # Initial wait for indexing to start
+        # Poll until the index count catches up, backing off from 1 second
         try:
             print("\nVerifying index count...")
-            for _ in range(10): # Try for up to 50 seconds
+            def is_populated():
                 index_stats = self.index.describe_index_stats()
                 vector_count = index_stats.get('total_vector_count', 0)
                 print(f"Current vector count: {vector_count}. Expected: {len(vectors)}")
-                if vector_count == len(vectors):
-                    print("Index is fully populated.")
-                    break
-                time.sleep(5)
+                return vector_count == len(vectors)
+            
+            if _wait_until(is_populated, timeout=50):
+                print("Index is fully populated.")
             else:
                 print("Warning: Index vector count did not match expected count after waiting.")
             
@@ -137,54 +470,100 @@ class VectorDB:
         except Exception as e:
             print(f"\nCould not get index stats: {str(e)}")
     
+    def _upsert_faiss(self, vectors):
+        """Add vectors to the local FAISS index, replacing any existing ids."""
+        arr = np.stack([v['values'] for v in vectors]).astype(np.float32, copy=False)
+        faiss.normalize_L2(arr)
+        
+        replaced = False
+        new_rows = []
+        for row, v in enumerate(vectors):
+            pos = self._id_pos.get(v['id'])
+            if pos is None:
+                self._id_pos[v['id']] = len(self._meta)
+                self._meta.append((v['id'], v['metadata']))
+                new_rows.append(row)
+            else:
+                self._meta[pos] = (v['id'], v['metadata'])
+                replaced = True
+        
+        if replaced:
+            # IndexFlatIP has no in-place update, so rebuild it from the stored vectors
+            stored = np.empty((len(self._meta), self.embedding_dim), dtype=np.float32)
+            if self._faiss.ntotal:
+                stored[:self._faiss.ntotal] = self._faiss.reconstruct_n(0, self._faiss.ntotal)
+            for row, v in enumerate(vectors):
+                stored[self._id_pos[v['id']]] = arr[row]
+            self._faiss.reset()
+            self._faiss.add(stored)
+        elif new_rows:
+            self._faiss.add(arr[new_rows])
+        
+        print(f"\nCompleted upserting {len(vectors)} documents to local FAISS index ({self._faiss.ntotal} total)")
+        self.data_version += 1
+    
+    def _search_faiss(self, query_text, top_k):
+        """Search the local FAISS index."""
+        if self._faiss.ntotal == 0:
+            return SearchResults([])
+        
+        q = np.array(self.embed_query(query_text), dtype=np.float32)[None, :]
+        faiss.normalize_L2(q)
+        D, I = self._faiss.search(q, top_k)
+        
+        matches = []
+        for score, pos in zip(D[0], I[0]):
+            if pos < 0:  # fewer than top_k vectors in the index
+                continue
+            doc_id, metadata = self._meta[pos]
+            matches.append(Match.from_metadata(doc_id, score, metadata))
+        return SearchResults(matches)
+    
     def search(self, query_text, top_k=3):
         """Search for similar documents."""
+        if self.backend == "faiss":
+            try:
+                return self._search_faiss(query_text, top_k)
+            except Exception as e:
+                print(f"Error in search: {str(e)}")
+                return SearchResults([])
+        
         query_embedding = self.embed_text(query_text)
         
         try:
             # Query the index
             results = self.index.query(
-                vector=query_embedding,
+                vector=query_embedding.tolist(),
                 top_k=top_k,
                 include_metadata=True
             )
             
             # Convert to the expected format
-            class SearchResults:
-                def __init__(self, matches):
-                    self.matches = matches
-                    
-            class Match:
-                def __init__(self, id, score, metadata):
-                    self.id = id
-                    self.score = score
-                    self.metadata = metadata
-                    
             matches = []
             
             if 'matches' not in results or not results['matches']:
                 return SearchResults([])
+            
+            # Rehydrate text and metadata from the local document store in one query
+            docs = get_document_store().get_many(
+                self.index_name, (match.get('id', '') for match in results['matches'])
+            )
                 
             for match in results['matches']:
                 # Handle different possible metadata formats
                 metadata = match.get('metadata', {})
                 if isinstance(metadata, str):
                     try:
-                        metadata = json.loads(metadata)
-                    except (json.JSONDecodeError, TypeError):
+                        metadata = orjson.loads(metadata)
+                    except (orjson.JSONDecodeError, TypeError):
                         metadata = {'text': str(metadata)}
+                # Vectors upserted before the document store existed still carry their text
+                metadata = {**metadata, **docs.get(match.get('id', ''), {})}
                 
-                # Ensure we have the required fields
-                match_metadata = {
-                    'text': metadata.get('text', ''),
-                    'source': metadata.get('source', 'unknown'),
-                    'metadata': metadata.get('metadata', {})
-                }
-                
-                matches.append(Match(
-                    id=match.get('id', ''),
-                    score=match.get('score', 0.0),
-                    metadata=match_metadata
+                matches.append(Match.from_metadata(
+                    match.get('id', ''),
+                    match.get('score') or 0.0,
+                    metadata
                 ))
                 
             return SearchResults(matches)
@@ -192,16 +571,12 @@ class VectorDB:
         except Exception as e:
             print(f"Error in search: {str(e)}")
             # Return empty results on error
-            class SearchResults:
-                def __init__(self, matches):
-                    self.matches = matches
             return SearchResults([])
 
 def load_sample_data():
     """Load sample data from JSON file."""
     data_path = Path("data") / "sample_data.json"
-    with open(data_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return orjson.loads(data_path.read_bytes())
 
 def setup_vector_db():
     """Set up the vector database with sample data."""
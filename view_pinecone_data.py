@@ -2,6 +2,38 @@ import os
 from dotenv import load_dotenv
 from pinecone import Pinecone
 import json
+from document_store import get_document_store
+
+def _list_document_pages(index):
+    """Yield pages of (id, metadata) using list()/fetch(); only serverless indexes support list()."""
+    for ids in index.list(limit=100):
+        vectors = index.fetch(ids=ids).vectors
+        yield [(vid, vectors[vid].metadata or {}) for vid in ids if vid in vectors]
+
+def _query_document_pages(index, total_vectors):
+    """Yield a single page of (id, metadata) by querying with a zero vector for every item.
+    Fallback for pod-based indexes, where list() is not available.
+    """
+    all_vectors = index.query(
+        vector=[0]*384, # Query with a dummy zero vector
+        top_k=total_vectors, # Ask for all vectors
+        include_metadata=True
+    )
+    yield [(match.get('id'), match.get('metadata') or {}) for match in all_vectors['matches']]
+
+def _iter_document_pages(index, total_vectors):
+    """Page through an index with list()/fetch(), falling back to a zero-vector query."""
+    pages = _list_document_pages(index)
+    try:
+        first = next(pages)
+    except StopIteration:
+        return
+    except Exception as e:
+        print(f"Paginated listing is unavailable for this index ({e}); querying for all vectors instead.")
+        yield from _query_document_pages(index, total_vectors)
+        return
+    yield first
+    yield from pages
 
 def view_data_in_pinecone(index_name="rag-demo"):
     """Fetches and displays all documents from a Pinecone index."""
@@ -33,25 +65,23 @@ def view_data_in_pinecone(index_name="rag-demo"):
         return
 
     # 4. Fetch all vectors
-    # Pinecone's query-all approach: query with a zero vector to get all items
+    # Page through IDs with list() and fetch metadata in bounded batches,
+    # so large serverless indexes never need a single top_k=N scan.
     print("\nFetching all vectors from the index...")
     try:
-        # Note: A more robust way for large indexes is pagination
-        # For this small example, querying for all is fine.
-        all_vectors = index.query(
-            vector=[0]*384, # Query with a dummy zero vector
-            top_k=total_vectors, # Ask for all vectors
-            include_metadata=True
-        )
-
-        print(f"\n--- Stored Documents (Total: {len(all_vectors['matches'])}) ---")
-        for i, match in enumerate(all_vectors['matches']):
-            metadata = match.get('metadata', {})
-            print(f"\n--- Document {i+1} ---")
-            print(f"  ID: {match.get('id')}")
-            print(f"  Score (relative to zero vector): {match.get('score'):.4f}")
-            print(f"  Source: {metadata.get('source')}")
-            print(f"  Text: {metadata.get('text')}")
+        print("\n--- Stored Documents ---")
+        count = 0
+        for page in _iter_document_pages(index, total_vectors):
+            # Pinecone only stores the source; text lives in the local document store
+            docs = get_document_store().get_many(index_name, [vid for vid, _ in page])
+            for vid, vector_metadata in page:
+                metadata = {**vector_metadata, **docs.get(vid, {})}
+                count += 1
+                print(f"\n--- Document {count} ---")
+                print(f"  ID: {vid}")
+                print(f"  Source: {metadata.get('source')}")
+                print(f"  Text: {metadata.get('text')}")
+        print(f"\n--- Total: {count} ---")
         print("\n-----------------------------------------")
 
     except Exception as e: